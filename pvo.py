@@ -12,30 +12,61 @@ SPDX-License-Identifier: Apache-2.0
 """
 
 import argparse
-from io import StringIO
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO, StringIO
+from functools import lru_cache
+from itertools import repeat
+import os
 import sys
 import logging
-import math
+import mmap
 from pathlib import Path
+from queue import Queue
+import shutil
+import subprocess
 import tarfile
-from typing import cast
+from threading import Thread
+from typing import BinaryIO, cast, Optional
 
 import numpy as np
-from PIL import Image, ImageFile, UnidentifiedImageError
+import PIL
+from PIL import (ExifTags, Image, ImageFile, ImageOps,
+                 UnidentifiedImageError)
 import cv2
+try:
+    import av
+    _HAS_AV = True
+except ImportError:
+    _HAS_AV = False  # OpenCV or ffmpeg decode videos without it
+try:
+    import turbojpeg
+    _TURBO_JPEG: Optional["turbojpeg.TurboJPEG"] = turbojpeg.TurboJPEG()
+except (ImportError, RuntimeError, OSError):
+    _TURBO_JPEG = None  # OpenCV encodes JPEG without it
+
+_FFMPEG = shutil.which("ffmpeg")
+_PIGZ = shutil.which("pigz")
 
 
 class Settings:
     """Contains launch parameters and default settings."""
 
+    # each launch parameter is kept as its own attribute
+    # pylint: disable=too-many-instance-attributes
+
     VERSION = "2.0.2"
     DIRECTORY_MODE = 0o750
+    LOG_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+    LOG_DATEFMT = '%Y%m%d_%H%M%S'
     SOURCE = "./tests/examples"
     DESTINATION = "./tests/"
 
     small_size = (128, 128)
     frames_percents = (1, 35, 65, 99)
     do_not_tar = False
+    jobs = os.cpu_count() or 1
+    post_jpeg: Optional[str] = "jpegoptim"
+    post_png: Optional[str] = "optipng"
     source: Path
     thumbnails: Path
     launch_args: argparse.Namespace
@@ -82,6 +113,16 @@ class Settings:
                  f'{Settings.frames_percents[2]}/'
                  f'{Settings.frames_percents[3]}')
 
+        parser.add_argument(
+            '-j', '--jobs',
+            help='Number of parallel processes, default is the number '
+                 'of CPUs (1 - process files one by one)')
+
+        parser.add_argument(
+            '-n', '--no-postprocess', action="store_true",
+            help=f'Do not optimize thumbnails by {Settings.post_jpeg} '
+                 f'and {Settings.post_png}')
+
         return parser.parse_args()
 
     @staticmethod
@@ -145,28 +186,403 @@ class Settings:
                                "should be >=0 and <=100")
         self.frames_percents = cast(tuple[int, int, int, int], candidate)
 
+    def set_jobs(self) -> None:
+        """Define number of parallel processes from launch parameter."""
+        if not self.launch_args.jobs:
+            return
+
+        candidate = int(self.launch_args.jobs)
+        if candidate < 1:
+            raise RuntimeError("Number of jobs should be >=1")
+        self.jobs = candidate
+
+    def set_postprocess(self) -> None:
+        """Find optimizers of thumbnails, unless disabled by parameter."""
+        if self.launch_args.no_postprocess:
+            self.post_jpeg = self.post_png = None
+            return
+
+        if self.post_jpeg:
+            self.post_jpeg = shutil.which(self.post_jpeg)
+        if self.post_png:
+            self.post_png = shutil.which(self.post_png)
+        logging.debug("optimizers of thumbnails are %s and %s",
+                      self.post_jpeg, self.post_png)
+
     def __init__(self, launch_args: argparse.Namespace) -> None:
         self.launch_args = launch_args
 
         Settings.set_log_level(launch_args)
         logging.debug("Running %s version %s",
                       Path(__file__).name, Settings.VERSION)
+        if ".post" in PIL.__version__:
+            logging.info("Pillow-SIMD %s is used for resizing",
+                         PIL.__version__)
+        else:
+            logging.info("Pillow %s is used for resizing (not SIMD build)",
+                         PIL.__version__)
 
         self.set_source()
         self.set_thumbnails()
         self.set_small_size()
         self.set_frames_percents()
+        self.set_jobs()
+        self.set_postprocess()
         self.do_not_tar = launch_args.plain is True
 
         ImageFile.LOAD_TRUNCATED_IMAGES = True
 
 
+def _init_worker(log_level: int) -> None:
+    """
+    Prepare worker process like the main one and keep it single-threaded.
+
+    Spawned (not forked) workers do not inherit the logging and PIL setup,
+    and the worker processes share CPUs. Video decoders take the number of
+    threads from OpenCV, see _decoder_threads().
+    """
+    logging.basicConfig(format=Settings.LOG_FORMAT,
+                        datefmt=Settings.LOG_DATEFMT)
+    logging.getLogger().setLevel(log_level)
+    ImageFile.LOAD_TRUNCATED_IMAGES = True
+    cv2.setNumThreads(1)
+
+
+def _decoder_threads() -> int:
+    """Return number of video decoding threads, one in worker processes."""
+    return cv2.getNumThreads()
+
+
+def _read_source(source: Path) -> mmap.mmap:
+    """
+    Map the whole file into memory, advising the kernel to read it ahead.
+
+    Raise ValueError for an empty file, it can not be mapped.
+    """
+    with open(source, "rb") as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mmap, "MADV_SEQUENTIAL"):
+        mapped.madvise(mmap.MADV_SEQUENTIAL)
+        mapped.madvise(mmap.MADV_WILLNEED)
+    return mapped
+
+
+def _encode_jpeg(image: np.ndarray) -> Optional[bytes]:
+    """Encode BGR image to progressive JPEG by libjpeg-turbo or OpenCV."""
+    if _TURBO_JPEG is not None:
+        return cast(bytes, _TURBO_JPEG.encode(
+            image, quality=80, jpeg_subsample=turbojpeg.TJSAMP_420,
+            flags=turbojpeg.TJFLAG_PROGRESSIVE))
+    success, buffer = cv2.imencode(
+        ".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 80,
+                        cv2.IMWRITE_JPEG_OPTIMIZE, 1,
+                        cv2.IMWRITE_JPEG_PROGRESSIVE, 1])
+    return buffer.tobytes() if success else None
+
+
+def _write_collage(destination: Path, collage: np.ndarray) -> bool:
+    """Encode and write 2x2 collage of video frames."""
+    logging.info("Creating video thumbnail %s", destination.name)
+    data = _encode_jpeg(collage)
+    if data is None:
+        return False
+    destination.write_bytes(data)
+    return True
+
+
+def _thumbnail_jpeg(raw: mmap.mmap, size: tuple[int, int], source: Path,
+                    destination: Path,
+                    small_size: tuple[int, int]) -> Optional[bytes]:
+    """
+    Return sized copy of JPEG image decoded and resized by OpenCV.
+
+    Return None if OpenCV can not decode it, e.g. the file is truncated.
+    """
+    # like Image.draft(), decode at 1/2, 1/4 or 1/8 scale right in libjpeg;
+    # both orientations are checked, because OpenCV applies EXIF rotation
+    reduce = min(size[0] // small_size[0], size[1] // small_size[1],
+                 size[0] // small_size[1], size[1] // small_size[0])
+    flag = cv2.IMREAD_COLOR
+    for factor, reduced_flag in ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                                 (4, cv2.IMREAD_REDUCED_COLOR_4),
+                                 (2, cv2.IMREAD_REDUCED_COLOR_2)):
+        if reduce >= factor:
+            flag = reduced_flag
+            break
+
+    image = cv2.imdecode(np.frombuffer(raw, np.uint8), flag)
+    if image is None:
+        logging.debug("OpenCV cannot decode image file '%s'", source)
+        return None
+
+    height, width = image.shape[:2]
+    scale = min(small_size[0] / width, small_size[1] / height, 1.0)
+    if scale < 1:
+        image = cv2.resize(
+            image, (max(1, round(width*scale)), max(1, round(height*scale))),
+            interpolation=cv2.INTER_AREA)
+    logging.info("Creating image thumbnail %s", destination.name)
+    return _encode_jpeg(image)
+
+
+def _thumbnail_image(raw: mmap.mmap, source: Path, destination: Path,
+                     small_size: tuple[int, int]) -> Optional[bytes]:
+    """Return encoded sized copy of image or None if it is broken."""
+    logging.debug("processing image %s", destination.name)
+    try:
+        img = Image.open(cast(BinaryIO, raw))  # mmap is file-like
+    except UnidentifiedImageError:
+        logging.error("cannot identify image file '%s'", source)
+        return None
+
+    with img:
+        if (img.format == "JPEG" and
+                destination.suffix.lower() in (".jpg", ".jpeg")):
+            data = _thumbnail_jpeg(raw, img.size, source, destination,
+                                   small_size)
+            if data is not None:
+                return data
+        try:
+            # the small image is rotated, so it is fitted into a turned box
+            orientation = img.getexif().get(ExifTags.Base.Orientation, 1)
+            size = (small_size[::-1] if orientation in (5, 6, 7, 8)
+                    else small_size)
+            if img.format == "JPEG":
+                # decode at 1/2, 1/4 or 1/8 scale right in libjpeg
+                img.draft("RGB", size)
+            img.thumbnail(size)
+            ImageOps.exif_transpose(img, in_place=True)
+        except OSError as e:
+            logging.error("%s, %s", e, source.name)
+            return None
+        logging.info("Creating image thumbnail %s", destination.name)
+        buffer = BytesIO()
+        img.save(buffer,
+                 Image.registered_extensions()[destination.suffix.lower()],
+                 optimize=True, progressive=True, exif=b"")
+        return buffer.getvalue()
+
+
+def _optimize(destination: Path, post_jpeg: Optional[str],
+              post_png: Optional[str]) -> None:
+    """Losslessly shrink written thumbnail by jpegoptim or optipng."""
+    suffix = destination.suffix.lower()
+    if post_jpeg and suffix in (".jpg", ".jpeg"):
+        command = [post_jpeg, "--strip-all", "--all-progressive", "-q"]
+    elif post_png and suffix == ".png":
+        command = [post_png, "-quiet"]
+    else:
+        return
+    subprocess.run(command + [str(destination)], check=False)
+
+
+def _do_image(source: Path, destination: Path, small_size: tuple[int, int],
+              post_jpeg: Optional[str], post_png: Optional[str]) -> None:
+    """Make a sized copy of image (picklable for worker processes)."""
+    try:
+        mapped = _read_source(source)
+    except (OSError, ValueError) as e:
+        logging.error("%s, %s", e, source.name)
+        return
+    with mapped:
+        data = _thumbnail_image(mapped, source, destination, small_size)
+    if data is not None:
+        destination.write_bytes(data)
+        _optimize(destination, post_jpeg, post_png)
+
+
+@lru_cache(maxsize=1024)
+def _frames_numbers(frames_percents: tuple[int, int, int, int],
+                    max_number: int) -> tuple[int, ...]:
+    """Calculate the frame numbers from percentages, as ceil in integers."""
+    return tuple(-(-percent * max_number // 100)
+                 for percent in frames_percents)
+
+
+def _av_frame(container: "av.container.InputContainer",
+              stream: "av.video.stream.VideoStream",
+              number: int) -> Optional[np.ndarray]:
+    """
+    Decode video frame by its number, None if the video is shorter.
+
+    It seeks to the keyframe at or before the frame and decodes forward
+    only up to it.
+    """
+    # frame number <-> pts, as OpenCV does for CAP_PROP_POS_FRAMES
+    pts_per_frame = 1 / (stream.average_rate * stream.time_base)
+    start = stream.start_time or 0
+    container.seek(start + int(number * pts_per_frame), stream=stream)
+    for frame in container.decode(stream):
+        if (frame.pts is not None and
+                round((frame.pts - start) / pts_per_frame) >= number):
+            return cast(np.ndarray, frame.to_ndarray(format="bgr24"))
+    return None
+
+
+def _av_frames(source: Path, frames_percents: tuple[int, int, int, int]
+               ) -> tuple[tuple[int, ...], dict[int, np.ndarray]]:
+    """
+    Decode video frames by their percentages, return numbers and images.
+
+    Frames missing in the video are not returned.
+    """
+    with av.open(str(source)) as container:
+        stream = container.streams.video[0]
+        if not (stream.frames and stream.average_rate and stream.time_base):
+            return (), {}
+        stream.codec_context.thread_count = _decoder_threads()
+        frames = _frames_numbers(frames_percents, stream.frames - 1)
+        images: dict[int, np.ndarray] = {}
+        for number in sorted(set(frames)):
+            image = _av_frame(container, stream, number)
+            if image is not None:
+                images[number] = image
+    return frames, images
+
+
+def _av_collage(source: Path, destination: Path, small_size: tuple[int, int],
+                frames_percents: tuple[int, int, int, int]) -> bool:
+    """
+    Make a 2x2 collage of video frames by PyAV seeking each of them.
+
+    Return False if PyAV can not get the frames.
+    """
+    assert _HAS_AV
+    try:
+        frames, images = _av_frames(source, frames_percents)
+    except (av.FFmpegError, IndexError) as e:
+        logging.debug("PyAV failed on %s: %s", source.name, e)
+        return False
+    if not frames or len(images) != len(set(frames)):
+        return False
+
+    collage = _new_collage(small_size)
+    for i, frame_number in enumerate(frames):
+        _blit_frame(collage, i, images[frame_number])
+    return _write_collage(destination, collage)
+
+
+def _ffmpeg_frame(source: Path, second: float,
+                  small_size: tuple[int, int]) -> Optional[np.ndarray]:
+    """
+    Decode a sized video frame by ffmpeg seeking the input to it.
+
+    Return None if ffmpeg fails or the video is shorter.
+    """
+    assert _FFMPEG is not None
+    result = subprocess.run(
+        [_FFMPEG, "-v", "error", "-nostdin", "-ss", f"{second:.6f}",
+         "-threads", str(_decoder_threads()), "-i", str(source),
+         "-frames:v", "1",
+         "-vf", f"scale={small_size[0]}:{small_size[1]}:flags=area",
+         "-f", "rawvideo", "-pix_fmt", "bgr24", "pipe:1"],
+        capture_output=True, check=False)
+    if (result.returncode != 0 or
+            len(result.stdout) != small_size[0] * small_size[1] * 3):
+        logging.debug("ffmpeg failed on %s: %s", source.name,
+                      result.stderr.decode(errors="replace"))
+        return None
+    return np.frombuffer(result.stdout, np.uint8).reshape(
+        small_size[1], small_size[0], 3)
+
+
+def _ffmpeg_collage(source: Path, destination: Path,
+                    small_size: tuple[int, int], frames: tuple[int, ...],
+                    fps: float) -> bool:
+    """
+    Make a 2x2 collage of video frames by ffmpeg seeking each of them.
+
+    Return False if some frame is not decoded.
+    """
+    collage = _new_collage(small_size)
+    for i, frame in enumerate(frames):
+        image = _ffmpeg_frame(source, frame / fps, small_size)
+        if image is None:
+            return False
+        _blit_frame(collage, i, image)
+    return _write_collage(destination, collage)
+
+
+def _new_collage(small_size: tuple[int, int]) -> np.ndarray:
+    """
+    Allocate the only buffer of 2x2 collage of video frames.
+
+    The frames are resized straight into its quadrants by _blit_frame, so
+    no stacking of them is needed.
+    """
+    return np.empty((2*small_size[1], 2*small_size[0], 3), dtype=np.uint8)
+
+
+def _blit_frame(collage: np.ndarray, index: int, image: np.ndarray) -> None:
+    """Resize video frame straight into its quadrant of 2x2 collage."""
+    height, width = collage.shape[0] // 2, collage.shape[1] // 2
+    row, col = (index // 2) * height, (index % 2) * width
+    cv2.resize(image, (width, height),
+               dst=collage[row:row+height, col:col+width],
+               interpolation=cv2.INTER_AREA)
+
+
+def _cv2_collage(vid_cap: cv2.VideoCapture, destination: Path,
+                 small_size: tuple[int, int], frames: tuple[int, ...]) -> bool:
+    """
+    Make a 2x2 collage of video frames by seeking each of them.
+
+    Return False if some frame is not read.
+    """
+    collage = _new_collage(small_size)
+    frames_read = 0
+    for i, frame in enumerate(frames):
+        vid_cap.set(cv2.CAP_PROP_POS_FRAMES, frame)
+        success, image = vid_cap.read()
+        if success:
+            _blit_frame(collage, i, image)
+            frames_read += 1
+
+    if frames_read != 4:
+        return False
+    return _write_collage(destination, collage)
+
+
+def _do_video(source: Path, destination: Path, small_size: tuple[int, int],
+              frames_percents: tuple[int, int, int, int],
+              post_jpeg: Optional[str]) -> None:
+    """Make a 2x2 collage of video frames (picklable for worker processes)."""
+    logging.debug("processing video %s", destination.name)
+    sys.stderr = temp_stderr = StringIO()
+    written = _HAS_AV and _av_collage(source, destination, small_size,
+                                      frames_percents)
+    if not written:
+        vid_cap = cv2.VideoCapture(str(source))
+        frames_max_number = int(vid_cap.get(cv2.CAP_PROP_FRAME_COUNT)) - 1
+        frames = _frames_numbers(frames_percents, frames_max_number)
+        fps = vid_cap.get(cv2.CAP_PROP_FPS)
+        written = (_FFMPEG is not None and fps > 0 and
+                   _ffmpeg_collage(source, destination, small_size, frames,
+                                   fps))
+        if not written:
+            written = _cv2_collage(vid_cap, destination, small_size, frames)
+        vid_cap.release()
+
+    sys.stderr = sys.__stderr__
+    logging.debug(temp_stderr.getvalue())
+    temp_stderr.close()
+
+    if written:
+        _optimize(destination, post_jpeg, None)
+
+
 class Copier:
     """To copy files from source to destination with resizing."""
 
-    SUFFIXES_IMAGES = {".jpg", ".jpeg", ".png", ".gif", '.bmp'}
-    SUFFIXES_VIDEOS = {".mp4", ".avi", '.mov', '.mpg', '.m4v', ".wav", ".mts",
-                       ".3gp"}
+    SUFFIXES_IMAGES = frozenset({".jpg", ".jpeg", ".png", ".gif", '.bmp'})
+    SUFFIXES_VIDEOS = frozenset({".mp4", ".avi", '.mov', '.mpg', '.m4v',
+                                 ".wav", ".mts", ".3gp"})
+    # kind of file by its suffix: 0 - image, 1 - video
+    SUFFIX_KIND = ({suffix: 0 for suffix in SUFFIXES_IMAGES} |
+                   {suffix: 1 for suffix in SUFFIXES_VIDEOS})
+    # added to the file name to get its thumbnail name, by kind of file
+    THUMBNAIL_ENDINGS = ("", ".jpg")
+    PREFETCH = 4
     settings: Settings
 
     @staticmethod
@@ -177,79 +593,124 @@ class Copier:
 
         The 'max_number' is 0-based index.
         """
-        return [math.ceil(i*max_number/100) for i in frames_percents]
-
-    def clone_image(self, source: Path, destination: Path) -> None:
-        """Make a sized copy of image."""
-        logging.debug("processing image %s", destination.name)
-        try:
-            img = Image.open(source)
-        except UnidentifiedImageError as e:
-            logging.error(e)
-        else:
-            with img:
-                try:
-                    img.thumbnail(self.settings.small_size)
-                except OSError as e:
-                    logging.error("%s, %s", e, source.name)
-                    return
-                logging.info("Creating image thumbnail %s", destination.name)
-                img.save(destination)
+        return list(_frames_numbers(frames_percents, max_number))
 
     def clone_video(self, source: Path, destination: Path) -> None:
         """Make a 2x2 collage of video frames."""
-        logging.debug("processing video %s", destination.name)
-        sys.stderr = temp_stderr = StringIO()
-        vid_cap = cv2.VideoCapture(str(source))
-        frames_max_number = int(vid_cap.get(cv2.CAP_PROP_FRAME_COUNT)) - 1
-        frames_img = []
-        for frame in Copier.frames_numbers(
-                self.settings.frames_percents, frames_max_number):
-            vid_cap.set(cv2.CAP_PROP_POS_FRAMES, frame)
-            success, image = vid_cap.read()
-            if success:
-                frames_img.append(cv2.resize(image, self.settings.small_size))
-
-        sys.stderr = sys.__stderr__
-        logging.debug(temp_stderr.getvalue())
-        temp_stderr.close()
-
-        compression_params = [cv2.IMWRITE_JPEG_QUALITY, 80]
-        if len(frames_img) == 4:
-            logging.info("Creating video thumbnail %s", destination.name)
-            row1 = np.hstack((frames_img[0], frames_img[1]))
-            row2 = np.hstack((frames_img[2], frames_img[3]))
-            collage = np.vstack((row1, row2))
-            cv2.imwrite(str(destination), collage, compression_params)
+        _do_video(source, destination, self.settings.small_size,
+                  self.settings.frames_percents, self.settings.post_jpeg)
 
     def create_thumbnails(self) -> None:
         """Walk through source directory to make a thumbnail."""
+        pairs: tuple[list[tuple[Path, Path]], ...] = ([], [])
         for cur_source, _, files in self.settings.source.walk(
                 on_error=logging.error):
             print(f"Iterate through {cur_source} [{len(files)} file(s)]")
-            cur_destination = Path(str(cur_source).replace(
-                str(self.settings.source), str(self.settings.thumbnails)))
+            cur_destination = (self.settings.thumbnails /
+                               cur_source.relative_to(self.settings.source))
             cur_destination.mkdir(mode=Settings.DIRECTORY_MODE, exist_ok=True)
+            with os.scandir(cur_destination) as entries:
+                existing = {entry.name for entry in entries}
 
             for file_name in files:
-                source_child = cur_source / file_name
-                suffix = source_child.suffix.lower()
+                kind = Copier.SUFFIX_KIND.get(
+                    os.path.splitext(file_name)[1].lower())
+                if kind is None:
+                    print("unsupported file:", file_name)
+                    continue
+
+                thumbnail_name = file_name + Copier.THUMBNAIL_ENDINGS[kind]
+                if thumbnail_name in existing:
+                    logging.info("Skipp exist file %s", thumbnail_name)
+                    continue
+
+                existing.add(thumbnail_name)
+                pairs[kind].append((cur_source / file_name,
+                                    cur_destination / thumbnail_name))
+
+        self.clone_files(*pairs)
+
+    def clone_files(self, images: list[tuple[Path, Path]],
+                    videos: list[tuple[Path, Path]]) -> None:
+        """Make thumbnails of collected (source, destination) pairs."""
+        if self.settings.jobs == 1:
+            self.pipe_images(images)
+            for source, destination in videos:
+                self.clone_video(source, destination)
+            return
 
-                destination_child = cur_destination / file_name
-                if suffix in Copier.SUFFIXES_VIDEOS:
-                    destination_child = destination_child.with_suffix(
-                        destination_child.suffix + ".jpg")
+        with ProcessPoolExecutor(
+                max_workers=self.settings.jobs, initializer=_init_worker,
+                initargs=(logging.getLogger().level,)) as executor:
+            results = [
+                executor.map(
+                    _do_image,
+                    [source for source, _ in images],
+                    [destination for _, destination in images],
+                    repeat(self.settings.small_size),
+                    repeat(self.settings.post_jpeg),
+                    repeat(self.settings.post_png),
+                    chunksize=8),
+                executor.map(
+                    _do_video,
+                    [source for source, _ in videos],
+                    [destination for _, destination in videos],
+                    repeat(self.settings.small_size),
+                    repeat(self.settings.frames_percents),
+                    repeat(self.settings.post_jpeg),
+                    chunksize=8)]
+            for result in results:
+                list(result)  # wait for the workers and reraise their errors
+
+    def pipe_images(self, images: list[tuple[Path, Path]]) -> None:
+        """
+        Make sized copies of images in three stages.
 
-                if destination_child.exists():
-                    logging.info("Skipp exist file %s", destination_child.name)
+        The reader and writer threads overlap disk I/O with resizing in the
+        current thread, the bounded queues give back-pressure.
+        """
+        loaded: Queue[Optional[tuple[Path, Path, mmap.mmap]]] = Queue(
+            Copier.PREFETCH)
+        encoded: Queue[Optional[tuple[Path, bytes]]] = Queue(Copier.PREFETCH)
+
+        def read() -> None:
+            try:
+                for source, destination in images:
+                    try:
+                        mapped = _read_source(source)
+                    except (OSError, ValueError) as e:
+                        logging.error("%s, %s", e, source.name)
+                        continue
+                    loaded.put((source, destination, mapped))
+            finally:
+                loaded.put(None)
+
+        def write() -> None:
+            while (item := encoded.get()) is not None:
+                try:
+                    item[0].write_bytes(item[1])
+                except OSError as e:
+                    logging.error(e)
                     continue
+                _optimize(item[0], self.settings.post_jpeg,
+                          self.settings.post_png)
 
-                if suffix in Copier.SUFFIXES_IMAGES:
-                    self.clone_image(source_child, destination_child)
-                elif suffix in Copier.SUFFIXES_VIDEOS:
-                    self.clone_video(source_child, destination_child)
-                else:
-                    print("unsupported file:", file_name)
+        threads = (Thread(target=read, daemon=True),
+                   Thread(target=write, daemon=True))
+        for thread in threads:
+            thread.start()
+        try:
+            while (loaded_item := loaded.get()) is not None:
+                source, destination, mapped = loaded_item
+                with mapped:
+                    data = _thumbnail_image(mapped, source, destination,
+                                            self.settings.small_size)
+                if data is not None:
+                    encoded.put((destination, data))
+        finally:
+            encoded.put(None)
+        for thread in threads:
+            thread.join()
 
     def to_tar(self) -> None:
         """Compress destination directory."""
@@ -260,20 +721,31 @@ class Copier:
         dest = self.settings.thumbnails
         tar_file_name = dest.with_suffix(".tar.gz")
         logging.info("Compress to %s", tar_file_name)
-        with tarfile.open(tar_file_name, "w:gz") as tar:
-            tar.add(dest, arcname=dest.name)
+        if _PIGZ:
+            self.to_tar_by_pigz(tar_file_name)
+        else:
+            with tarfile.open(tar_file_name, "w:gz") as tar:
+                tar.add(dest, arcname=dest.name)
 
         self.remove_thumbnails_directory()
 
+    def to_tar_by_pigz(self, tar_file_name: Path) -> None:
+        """Stream tar of destination directory through parallel gzip."""
+        assert _PIGZ is not None
+        dest = self.settings.thumbnails
+        with open(tar_file_name, "wb") as tar_file, subprocess.Popen(
+                [_PIGZ, "-p", str(self.settings.jobs)],
+                stdin=subprocess.PIPE, stdout=tar_file) as proc:
+            assert proc.stdin is not None
+            with tarfile.open(fileobj=proc.stdin, mode="w|") as tar:
+                tar.add(dest, arcname=dest.name)
+            proc.stdin.close()
+        if proc.returncode != 0:
+            raise RuntimeError(f"pigz failed with code {proc.returncode}")
+
     def remove_thumbnails_directory(self) -> None:
         """Remove temporary thumbnails directory."""
-        dest = self.settings.thumbnails
-        for root, dirs, files in dest.walk(top_down=False):
-            for name in files:
-                (root / name).unlink()
-            for name in dirs:
-                (root / name).rmdir()
-        dest.rmdir()
+        shutil.rmtree(self.settings.thumbnails)
 
     def __init__(self, settings: Settings):
         self.settings = settings
@@ -281,9 +753,8 @@ class Copier:
 
 def _main() -> None:
 
-    logging.basicConfig(
-        format="%(asctime)s [%(levelname)s] %(message)s",
-        datefmt='%Y%m%d_%H%M%S')
+    logging.basicConfig(format=Settings.LOG_FORMAT,
+                        datefmt=Settings.LOG_DATEFMT)
 
     settings = Settings(Settings.get_args())
     copier = Copier(settings)
@@ -10,12 +10,19 @@ SPDX-License-Identifier: Apache-2.0
 """
 
 import argparse
+from io import BytesIO
 import logging
+import os
+import shutil
+import tarfile
 from pathlib import Path
 from typing import Optional
 
-from pytest import fixture, raises
+import numpy as np
+from PIL import Image
+from pytest import fixture, raises, skip, MonkeyPatch
 
+import pvo
 from pvo import Settings, Copier
 
 # pylint: disable=redefined-outer-name, missing-function-docstring
@@ -25,7 +32,8 @@ def _arg_params() -> dict[str, Optional[str]]:
     """Create settings for reusing in tests."""
     return {"source": None, "destination": None,
             "loglevel": None, "plain": None,
-            "small_size": None, "frames_percents": None}
+            "small_size": None, "frames_percents": None,
+            "jobs": None, "no_postprocess": None}
 
 
 @fixture(scope="module")
@@ -34,6 +42,29 @@ def settings_without_args() -> Settings:
     return Settings(argparse.Namespace(**_arg_params()))
 
 
+def _tmp_settings(tmp_path: Path, **launch_args: object) -> Settings:
+    """Create settings to make thumbnails of two example images."""
+    source, destination = tmp_path / "photos", tmp_path / "out"
+    source.mkdir()
+    destination.mkdir()
+    shutil.copy("tests/examples/A.png", source)
+    shutil.copy("tests/examples/A.JPG", source)
+    arg_params: dict[str, object] = {
+        **_arg_params(), "source": str(source),
+        "destination": str(destination), "jobs": "1", **launch_args}
+    return Settings(argparse.Namespace(**arg_params))
+
+
+def _fake_program(monkeypatch: MonkeyPatch, directory: Path, name: str,
+                  script: str) -> None:
+    """Write shell script as a program found first in PATH."""
+    directory.mkdir(exist_ok=True)
+    program = directory / name
+    program.write_text(f"#!/bin/sh\n{script}\n")
+    program.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{directory}{os.pathsep}{os.environ['PATH']}")
+
+
 class TestSettings:
     """Test Settings class."""
 
@@ -85,6 +116,12 @@ class TestSettings:
         with raises(RuntimeError, match="is not a directory"):
             Settings(argparse.Namespace(**arg_params))
 
+    def test_set_jobs_from_args_less_than_one(self) -> None:
+        arg_params = _arg_params()
+        arg_params["jobs"] = "0"
+        with raises(RuntimeError, match="should be >=1"):
+            Settings(argparse.Namespace(**arg_params))
+
 
 class TestCopier:
     """Test Copier class."""
@@ -124,10 +161,12 @@ class TestCopier:
         func = Copier.frames_numbers
         assert func((0, 100, 0, 100), 99) == [0, 99, 0, 99]
 
-    def test_examples(self, settings_without_args: Settings) -> None:
-        copier = Copier(settings_without_args)
+    @staticmethod
+    def check_examples(settings: Settings) -> None:
+        """Make thumbnails of the examples and check them."""
+        copier = Copier(settings)
         copier.create_thumbnails()
-        path = settings_without_args.thumbnails
+        path = settings.thumbnails
 
         try:
 
@@ -158,3 +197,151 @@ class TestCopier:
 
         finally:
             copier.remove_thumbnails_directory()
+
+    def test_examples(self, settings_without_args: Settings) -> None:
+        TestCopier.check_examples(settings_without_args)
+
+    def test_examples_one_job(self) -> None:
+        arg_params = _arg_params()
+        arg_params["jobs"] = "1"
+        TestCopier.check_examples(Settings(argparse.Namespace(**arg_params)))
+
+    def test_examples_two_jobs(self) -> None:
+        arg_params = _arg_params()
+        arg_params["jobs"] = "2"
+        TestCopier.check_examples(Settings(argparse.Namespace(**arg_params)))
+
+    @staticmethod
+    def test_exif_orientation(tmp_path: Path) -> None:
+        """Test thumbnails are turned by EXIF and saved without it."""
+        source, destination = tmp_path / "rotated", tmp_path / "out"
+        source.mkdir()
+        destination.mkdir()
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: rotate 90 degrees clockwise
+        for name in ("wide.jpg", "wide.png"):
+            Image.new("RGB", (400, 200), "red").save(source / name,
+                                                     exif=exif)
+
+        arg_params = _arg_params()
+        arg_params["source"], arg_params["destination"] = (
+            str(source), str(destination))
+        arg_params["jobs"] = "1"
+        settings = Settings(argparse.Namespace(**arg_params))
+        Copier(settings).create_thumbnails()
+
+        for name in ("wide.jpg", "wide.png"):
+            with Image.open(settings.thumbnails / name) as thumbnail:
+                assert thumbnail.size == (64, 128)
+                assert len(thumbnail.getexif()) == 0
+
+    @staticmethod
+    def test_existing_thumbnail_is_kept(tmp_path: Path) -> None:
+        """Test an already made thumbnail is not rewritten."""
+        source, destination = tmp_path / "photos", tmp_path / "out"
+        source.mkdir()
+        destination.mkdir()
+        shutil.copy("tests/examples/A.png", source)
+        shutil.copy("tests/examples/A.JPG", source)
+
+        arg_params = _arg_params()
+        arg_params["source"], arg_params["destination"] = (
+            str(source), str(destination))
+        settings = Settings(argparse.Namespace(**arg_params))
+        settings.thumbnails.mkdir()
+        (settings.thumbnails / "A.png").write_bytes(b"old")
+        Copier(settings).create_thumbnails()
+
+        assert (settings.thumbnails / "A.png").read_bytes() == b"old"
+        assert (settings.thumbnails / "A.JPG").is_file()
+
+    @staticmethod
+    def test_truncated_jpeg(tmp_path: Path) -> None:
+        """Test a truncated JPEG gets a thumbnail by Pillow."""
+        source, destination = tmp_path / "broken", tmp_path / "out"
+        source.mkdir()
+        destination.mkdir()
+        data = Path("tests/examples/subdir_1/B.jpg").read_bytes()
+        (source / "B.jpg").write_bytes(data[:len(data) // 2])
+
+        arg_params = _arg_params()
+        arg_params["source"], arg_params["destination"] = (
+            str(source), str(destination))
+        arg_params["jobs"] = "1"
+        settings = Settings(argparse.Namespace(**arg_params))
+        Copier(settings).create_thumbnails()
+
+        with Image.open(settings.thumbnails / "B.jpg") as thumbnail:
+            assert max(thumbnail.size) == 128
+
+    @staticmethod
+    def test_to_tar_by_pigz(tmp_path: Path, monkeypatch: MonkeyPatch) -> None:
+        settings = _tmp_settings(tmp_path)
+        copier = Copier(settings)
+        copier.create_thumbnails()
+        _fake_program(monkeypatch, tmp_path / "bin", "pigz", "exec gzip -c")
+        monkeypatch.setattr(pvo, "_PIGZ", shutil.which("pigz"))
+        copier.to_tar()
+
+        with tarfile.open(settings.thumbnails.with_suffix(".tar.gz")) as tar:
+            assert sorted(tar.getnames()) == [
+                "photos-thumbnails", "photos-thumbnails/A.JPG",
+                "photos-thumbnails/A.png"]
+        assert not settings.thumbnails.exists()
+
+    @staticmethod
+    def test_to_tar_by_pigz_failed(tmp_path: Path,
+                                   monkeypatch: MonkeyPatch) -> None:
+        settings = _tmp_settings(tmp_path)
+        copier = Copier(settings)
+        copier.create_thumbnails()
+        _fake_program(monkeypatch, tmp_path / "bin", "pigz",
+                      "cat > /dev/null; exit 3")
+        monkeypatch.setattr(pvo, "_PIGZ", shutil.which("pigz"))
+        with raises(RuntimeError, match="pigz failed with code 3"):
+            copier.to_tar()
+        assert (settings.thumbnails / "A.png").is_file()
+
+    @staticmethod
+    def test_postprocess(tmp_path: Path, monkeypatch: MonkeyPatch) -> None:
+        """Test thumbnails are optimized by the programs found in PATH."""
+        log = tmp_path / "optimizers.log"
+        for name in ("jpegoptim", "optipng"):
+            _fake_program(monkeypatch, tmp_path / "bin", name,
+                          f"echo \"$0 $*\" >> {log}")
+        settings = _tmp_settings(tmp_path)
+        assert settings.post_jpeg == str(tmp_path / "bin" / "jpegoptim")
+        assert settings.post_png == str(tmp_path / "bin" / "optipng")
+        Copier(settings).create_thumbnails()
+
+        assert sorted(log.read_text().splitlines()) == [
+            f"{settings.post_jpeg} --strip-all --all-progressive -q "
+            f"{settings.thumbnails / 'A.JPG'}",
+            f"{settings.post_png} -quiet {settings.thumbnails / 'A.png'}"]
+
+    @staticmethod
+    def test_no_postprocess(tmp_path: Path, monkeypatch: MonkeyPatch) -> None:
+        log = tmp_path / "optimizers.log"
+        for name in ("jpegoptim", "optipng"):
+            _fake_program(monkeypatch, tmp_path / "bin", name,
+                          f"echo \"$0 $*\" >> {log}")
+        settings = _tmp_settings(tmp_path, no_postprocess=True)
+        assert settings.post_jpeg is None
+        assert settings.post_png is None
+        Copier(settings).create_thumbnails()
+
+        assert (settings.thumbnails / "A.JPG").is_file()
+        assert not log.exists()
+
+    @staticmethod
+    def test_encode_jpeg_by_turbojpeg() -> None:
+        """Test libjpeg-turbo encodes progressive JPEG, if it is installed."""
+        # pylint: disable=protected-access
+        if pvo._TURBO_JPEG is None:
+            skip("PyTurboJPEG or the libturbojpeg library is not installed")
+        data = pvo._encode_jpeg(np.zeros((72, 128, 3), np.uint8))
+        assert data is not None
+        with Image.open(BytesIO(data)) as thumbnail:
+            assert thumbnail.format == "JPEG"
+            assert thumbnail.size == (128, 72)
+            assert thumbnail.info.get("progressive")